@@ -1,4 +1,17 @@
-import re, glob
+import re, os, time, argparse, json, heapq, tempfile, hashlib, subprocess
+from contextlib import contextmanager
+
+parser = argparse.ArgumentParser(description='Generate styles.css from the utility classes used in the sources.')
+parser.add_argument('--target', choices=['legacy', 'modern'], help='collapse longhand declarations into the shorthands this browser-support target understands')
+parser.add_argument('--color-format', choices=['rgba', 'rgb', 'color-mix'], default='rgba', help='how colors with an /opacity modifier are written')
+parser.add_argument('--themes', help='JSON file mapping theme names to palette overlays, e.g. {"brand": {"primary": {"500": "#..."}}}')
+parser.add_argument('--theme-scope', action='store_true', help='write theme overrides into styles.css under [data-theme] selectors instead of one styles.<theme>.css per theme')
+parser.add_argument('--include', action='append', default=[], help='extra .gitignore-style pattern for source files to scan (repeatable)')
+parser.add_argument('--exclude', action='append', default=[], help='extra .gitignore-style pattern for paths to skip (repeatable)')
+parser.add_argument('--max-classes-in-memory', type=int, default=100_000, help='spill sorted runs of classes to disk past this many distinct classes')
+parser.add_argument('--discovery-cache', default='.build_styles_cache.json', help='file remembering directory listings between runs')
+parser.add_argument('--since-git', action='store_true', help='re-extract classes only from files changed since the commit recorded in styles.build.json and skip the build when the class set is unchanged')
+args = parser.parse_args()
 
 # Tailwind-like scales
 spacing = {
@@ -12,7 +25,7 @@ spacing = {
 colors = {
     'gray': {'50':'#f9fafb','100':'#f3f4f6','200':'#e5e7eb','300':'#d1d5db','400':'#9ca3af','500':'#6b7280','600':'#4b5563','700':'#374151','800':'#1f2937','900':'#111827'},
     'slate': {'50':'#f8fafc','100':'#f1f5f9','200':'#e2e8f0','300':'#cbd5e1','400':'#94a3b8','500':'#64748b','600':'#475569','700':'#334155','800':'#1e293b','900':'#0f172a'},
-    'blue': {'50':'#eff6ff','100':'#dbeafe','200':'#bfdbfe','300':'#93c5fd','400':'#60a5fa','500':'#3b82f6','600':'#2563eb','700':'1d4ed8','800':'#1e40af','900':'#1e3a8a'},
+    'blue': {'50':'#eff6ff','100':'#dbeafe','200':'#bfdbfe','300':'#93c5fd','400':'#60a5fa','500':'#3b82f6','600':'#2563eb','700':'#1d4ed8','800':'#1e40af','900':'#1e3a8a'},
     'indigo': {'50': '#eef2ff','100': '#e0e7ff','200': '#c7d2fe','300': '#a5b4fc','400': '#818cf8','500': '#6366f1','600': '#4f46e5','700': '#4338ca','800': '#3730a3','900': '#312e81'},
     'red': {'50':'#fef2f2','100':'#fee2e2','200':'#fecdd3','300':'#fca5a5','400':'#f87171','500':'#ef4444','600':'#dc2626','700':'#b91c1c','800':'#991b1b','900':'#7f1d1d'},
     'green': {'50':'#ecfdf3','100':'#d1fae5','200':'#a7f3d0','300':'#6ee7b7','400':'#34d399','500':'#22c55e','600':'#16a34a','700':'#15803d','800':'#166534','900':'#14532d'},
@@ -83,6 +96,29 @@ transition_map = {
     'all': 'all'
 }
 
+# Longhand pairs that collapse into one shorthand when both sides carry the same value
+shorthand_pairs = [
+    ('margin-inline', 'margin-left', 'margin-right'),
+    ('margin-block', 'margin-top', 'margin-bottom'),
+    ('padding-inline', 'padding-left', 'padding-right'),
+    ('padding-block', 'padding-top', 'padding-bottom'),
+    ('inset-inline', 'left', 'right'),
+    ('inset-block', 'top', 'bottom'),
+]
+
+# Shorthands each browser-support target can rely on (logical properties need Chrome 87 / Safari 14.1 / Firefox 66)
+browser_targets = {
+    'legacy': {'transition'},
+    'modern': {'transition', 'margin-inline', 'margin-block', 'padding-inline', 'padding-block', 'inset-inline', 'inset-block'},
+}
+
+root_vars = {
+    '--tw-gradient-from': 'initial',
+    '--tw-gradient-to': 'initial',
+    '--tw-gradient-stops': 'initial',
+    '--tw-ring-color': 'rgba(59,130,246,0.5)',
+}
+
 def escape_class(cls: str) -> str:
     escaped = ''
     for ch in cls:
@@ -92,50 +128,505 @@ def escape_class(cls: str) -> str:
             escaped += '\\' + ch
     return escaped
 
-def color_value(name, shade=None, alpha=None):
-    palette = colors.get(name)
-    if not palette:
+# (palette, shade) tokens read while resolving the current class, so theme overlays know what to re-resolve
+color_deps = set()
+
+
+hex_color = re.compile(r'#?([0-9a-fA-F]{3}|[0-9a-fA-F]{6})')
+color_keywords = {'transparent', 'currentColor', 'inherit'}
+
+
+def parse_hex(digits):
+    # all six-digit colors of a table are decoded in one go
+    raw = bytes.fromhex(''.join(digits))
+    return [list(raw[i:i+3]) for i in range(0, len(raw), 3)]
+
+
+def format_color(value, rgb, opacity):
+    if rgb is None:
+        return value
+    alpha = str(float(opacity)/100)
+    r, g, b = rgb
+    if args.color_format == 'rgb':
+        return f'rgb({r} {g} {b} / {alpha})'
+    if args.color_format == 'color-mix':
+        return f'color-mix(in srgb, {value} {opacity}%, transparent)'
+    return f'rgba({r}, {g}, {b}, {alpha})'
+
+
+def build_color_table(palettes):
+    # name -> shade -> [css value, (r, g, b) or None for keywords, {opacity step: css value}];
+    # shade None is the DEFAULT shade, or the first one when there is none
+    table = {}
+    pending = []
+    for name, palette in palettes.items():
+        shades = table[name] = {}
+        for shade, raw in palette.items():
+            match = hex_color.fullmatch(raw) if isinstance(raw, str) else None
+            if match:
+                digits = match.group(1)
+                if not raw.startswith('#'):
+                    print(f"warning: colors['{name}']['{shade}'] is missing '#', using '#{digits}'")
+                pending.append((name, shade, digits if len(digits) == 6 else ''.join(ch*2 for ch in digits)))
+                shades[shade] = ['#' + digits, None, {}]
+            elif isinstance(raw, str) and raw in color_keywords:
+                shades[shade] = [raw, None, {}]
+            else:
+                raise ValueError(f"colors['{name}']['{shade}']: {raw!r} is not a hex color")
+        if shades:
+            shades[None] = shades.get('DEFAULT') or next(iter(shades.values()))
+    for (name, shade, _), rgb in zip(pending, parse_hex([digits for _, _, digits in pending])):
+        table[name][shade][1] = rgb
+    for shades in table.values():
+        for entry in shades.values():
+            value, rgb, steps = entry
+            if rgb is not None and not steps:
+                steps.update((step, format_color(value, rgb, step)) for step in opacity_scale)
+    return table
+
+
+color_table = build_color_table(colors)
+theme_tables = {}
+theme_name = re.compile(r'[A-Za-z0-9_-]+')
+
+
+def theme_table(overlay):
+    key = json.dumps(overlay, sort_keys=True)
+    if key not in theme_tables:
+        palettes = {name: {**colors.get(name, {}), **palette} for name, palette in overlay.items()}
+        theme_tables[key] = (palettes, build_color_table(palettes))
+    return theme_tables[key]
+
+
+@contextmanager
+def themed(overlay):
+    palettes, table = theme_table(overlay)
+    saved = dict(colors), dict(color_table)
+    colors.update(palettes)
+    color_table.update(table)
+    try:
+        yield
+    finally:
+        for current, previous in zip((colors, color_table), saved):
+            current.clear()
+            current.update(previous)
+
+
+def color_value(name, shade=None, opacity=None):
+    color_deps.add((name, shade))
+    entry = color_table.get(name, {}).get(shade)
+    if not entry:
         return None
-    if shade is None:
-        val = palette.get('DEFAULT') or next(iter(palette.values()))
-    else:
-        val = palette.get(shade)
-    if not val:
+    value, rgb, steps = entry
+    if not opacity:
+        return value
+    if opacity not in steps:
+        steps[opacity] = format_color(value, rgb, opacity)
+    return steps[opacity]
+
+
+def resolve_color(token):
+    # shared by every color-bearing prefix: `name` or `name-shade`, optionally followed by `/opacity`
+    color_part, _, opacity = token.partition('/')
+    if opacity and not opacity.replace('.', '', 1).isdigit():
         return None
-    if alpha:
-        val = to_rgba(val, alpha)
-    return val
-
-
-def to_rgba(hex_color, alpha):
-    hex_color = hex_color.lstrip('#')
-    if len(hex_color) == 3:
-        hex_color = ''.join(ch*2 for ch in hex_color)
-    r = int(hex_color[0:2], 16)
-    g = int(hex_color[2:4], 16)
-    b = int(hex_color[4:6], 16)
-    return f'rgba({r}, {g}, {b}, {alpha})'
+    name, _, shade = color_part.partition('-')
+    return color_value(name, shade or None, opacity or None)
+
+
+# Source discovery: patterns follow .gitignore syntax and are matched against paths relative to the root
+source_includes = ['*.tsx', '*.ts', '*.jsx', '*.js', '*.html']
+source_excludes = ['.git/', 'node_modules/', 'dist/', '*.d.ts']
+
 
+def glob_to_regex(pattern):
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+        elif pattern[i] == '*':
+            regex += '[^/]*'
+            i += 1
+        elif pattern[i] == '?':
+            regex += '[^/]'
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i+1:]:
+            end = pattern.index(']', i+1)
+            chars = pattern[i+1:end]
+            # only a leading `!` negates the class; elsewhere it is a literal character
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+            regex += '[' + chars + ']'
+            i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return regex
+
+
+def compile_patterns(lines):
+    patterns = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        negate = line.startswith('!')
+        line = line.lstrip('!')
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        # a slash anywhere but the end anchors the pattern to the root
+        regex = glob_to_regex(line.lstrip('/'))
+        if '/' not in line:
+            regex = '(?:.*/)?' + regex
+        patterns.append((re.compile(regex + '$'), negate, dir_only))
+    return patterns
+
+
+def matches(patterns, rel, is_dir):
+    matched = False
+    for regex, negate, dir_only in patterns:
+        if (is_dir or not dir_only) and regex.match(rel):
+            matched = not negate
+    return matched
+
+
+def source_patterns(root):
+    gitignore = os.path.join(root, '.gitignore')
+    ignore_lines = open(gitignore).read().splitlines() if os.path.exists(gitignore) else []
+    ignore = compile_patterns(source_excludes + args.exclude + ignore_lines)
+    includes = compile_patterns(source_includes + args.include)
+    # everything that decides which files count as sources
+    selection = [ignore_lines, source_excludes + args.exclude, source_includes + args.include]
+    return selection, ignore, includes
+
+
+def is_source(rel, ignore, includes):
+    parts = rel.split('/')
+    for depth in range(1, len(parts)):
+        if matches(ignore, '/'.join(parts[:depth]), True):
+            return False
+    return not matches(ignore, rel, False) and matches(includes, rel, False)
+
+
+def discover_sources(root):
+    selection, ignore, includes = source_patterns(root)
+    signature = [os.path.abspath(root)] + selection
+    cached = {}
+    if os.path.exists(args.discovery_cache):
+        try:
+            cache = json.load(open(args.discovery_cache))
+        except ValueError:
+            cache = {}
+        if cache.get('signature') == signature:
+            cached = cache['dirs']
+    # listings of directories touched within this window are not trusted next run (mtime granularity)
+    racy_before = time.time_ns() - 2_000_000_000
+    fresh = {}
+    found = []
+    rescanned = 0
+    stack = ['']
+    while stack:
+        rel = stack.pop()
+        path = os.path.join(root, rel) if rel else root
+        mtime = os.stat(path).st_mtime_ns
+        entry = cached.get(rel)
+        # a directory's mtime only changes when entries are added, removed or renamed in it,
+        # so an unchanged directory keeps its listing and only its subdirectories are checked
+        if not entry or entry['mtime'] != mtime:
+            rescanned += 1
+            files, dirs = [], []
+            with os.scandir(path) as it:
+                for item in it:
+                    child = f'{rel}/{item.name}' if rel else item.name
+                    if item.is_dir(follow_symlinks=False):
+                        if not matches(ignore, child, True):
+                            dirs.append(item.name)
+                    elif not matches(ignore, child, False) and matches(includes, child, False):
+                        files.append(item.name)
+            entry = {'mtime': mtime if mtime < racy_before else None, 'files': files, 'dirs': dirs}
+        fresh[rel] = entry
+        found += [os.path.join(path, name) for name in entry['files']]
+        stack += [f'{rel}/{name}' if rel else name for name in entry['dirs']]
+    with open(args.discovery_cache, 'w') as f:
+        json.dump({'signature': signature, 'dirs': fresh}, f)
+    print(f'discovered {len(found)} source files ({rescanned} of {len(fresh)} directories rescanned)')
+    return sorted(found)
+
+
+# Git-aware builds: styles.build.json records the commit that produced styles.css and
+# styles.classes.json the classes each source file used at that point
+build_record_path = 'styles.build.json'
+class_snapshot_path = 'styles.classes.json'
+
+
+def git(*argv):
+    try:
+        result = subprocess.run(['git', *argv], capture_output=True, text=True, encoding='utf-8', errors='surrogateescape')
+    except FileNotFoundError:
+        return None
+    if result.returncode != 0:
+        return None
+    # -z output is NUL-separated and leaves non-ASCII paths unquoted
+    if '-z' in argv:
+        return [path for path in result.stdout.split('\0') if path]
+    return result.stdout.splitlines()
+
+
+def uncommitted_files():
+    diff = git('diff', '-z', '--name-only', '--no-renames', '--relative', 'HEAD', '--')
+    untracked = git('ls-files', '-z', '--others', '--exclude-standard')
+    if diff is None or untracked is None:
+        return None
+    return set(diff) | set(untracked)
+
+
+def changed_since(record):
+    commit = record.get('commit')
+    # shallow clones and rewritten history may not contain the recorded commit
+    if not commit or git('cat-file', '-e', f'{commit}^{{commit}}') is None:
+        return None
+    diff = git('diff', '-z', '--name-only', '--no-renames', '--relative', commit, '--')
+    untracked = git('ls-files', '-z', '--others', '--exclude-standard')
+    if diff is None or untracked is None:
+        return None
+    # files that were dirty when the snapshot was taken may since have been reverted to the recorded commit
+    return set(diff) | set(untracked) | set(record.get('dirty', []))
+
+
+def build_signature(themes):
+    # anything besides the class set that changes the generated CSS
+    generator = hashlib.sha256(open(__file__, 'rb').read()).hexdigest()
+    return [generator, themes, args.target, args.theme_scope, args.color_format]
+
+
+def git_changed_classes(signature, themes):
+    # Returns the refreshed per-file snapshot and whether the styles have to be rebuilt from it.
+    # The snapshot is only written by record_build, once the rebuilt styles are in place.
+    record, snapshot, changed = {}, {}, None
+    selection, ignore, includes = source_patterns('.')
+    if os.path.exists(build_record_path) and os.path.exists(class_snapshot_path):
+        record = json.load(open(build_record_path))
+        snapshot = json.load(open(class_snapshot_path))
+        # with other include/exclude rules the snapshot may hold files that are no longer sources, or miss new ones
+        if record.get('sources') == selection:
+            changed = changed_since(record)
+    if changed is None:
+        print('no usable build history for this source selection, scanning all sources')
+        snapshot = {os.path.relpath(path): sorted(set(scan_classes([path]))) for path in discover_sources('.')}
+        previous = None
+    else:
+        previous = set().union(*snapshot.values())
+        changed = [path for path in sorted(changed) if is_source(path, ignore, includes)]
+        for path in changed:
+            if os.path.isfile(path):
+                snapshot[path] = sorted(set(scan_classes([path])))
+            else:
+                snapshot.pop(path, None)
+        print(f're-extracted classes from {len(changed)} changed source files')
+    classes = set().union(*snapshot.values())
+    outputs = ['styles.css'] + ([] if args.theme_scope else [f'styles.{theme}.css' for theme in themes])
+    if classes == previous and record.get('signature') == signature and all(map(os.path.exists, outputs)):
+        print('class set unchanged, styles are up to date')
+        return snapshot, False
+    return snapshot, True
+
+
+def record_build(signature, snapshot):
+    with open(class_snapshot_path, 'w') as f:
+        json.dump(snapshot, f, indent=1, sort_keys=True)
+    head = git('rev-parse', 'HEAD')
+    selection, ignore, includes = source_patterns('.')
+    dirty = sorted(path for path in uncommitted_files() or [] if is_source(path, ignore, includes))
+    record = {'commit': head[0] if head else None, 'dirty': dirty, 'signature': signature, 'sources': selection}
+    with open(build_record_path, 'w') as f:
+        json.dump(record, f, indent=1)
+
+
+# rules produced by the class currently being resolved; resolve_classes drains it after every class
 rules = []
 
 class_pattern = re.compile(r'(?:[a-z]+:)?[a-z0-9\[\]\/]+(?:-[a-z0-9\[\]\/]+)+', re.IGNORECASE)
-classes=set()
-for path in glob.glob('*.tsx')+glob.glob('components/*.tsx'):
-    content = open(path).read()
-    # Capture tokens inside JSX string attributes and template literals, ignoring interpolated expressions
-    for token in class_pattern.findall(content):
-        classes.add(token)
-    for m in re.finditer(r'className="([^"]+)"', content):
-        classes.update(m.group(1).split())
+
+write_chunk_size = 64 * 1024
+
+
+def scan_classes(paths):
+    for path in paths:
+        content = open(path).read()
+        # Capture tokens inside JSX string attributes and template literals, ignoring interpolated expressions
+        for m in class_pattern.finditer(content):
+            yield m.group()
+        for m in re.finditer(r'className="([^"]+)"', content):
+            yield from m.group(1).split()
+
+
+def spill(names):
+    run = tempfile.TemporaryFile('w+')
+    run.writelines(f'{name}\n' for name in sorted(names))
+    run.seek(0)
+    return run
+
+
+def sort_classes(tokens, limit):
+    # Returns a callable that replays the sorted, de-duplicated classes. Past `limit` distinct
+    # classes the set is written out as a sorted run and the runs are merged from disk.
+    pending = set()
+    runs = []
+    for token in tokens:
+        pending.add(token)
+        if len(pending) > limit:
+            runs.append(spill(pending))
+            pending.clear()
+    if not runs:
+        ordered = sorted(pending)
+        return lambda: iter(ordered)
+    runs.append(spill(pending))
+    merged = tempfile.TemporaryFile('w+')
+    previous = None
+    for line in heapq.merge(*runs):
+        if line != previous:
+            merged.write(line)
+            previous = line
+    for run in runs:
+        run.close()
+
+    def replay():
+        merged.seek(0)
+        return (line.rstrip('\n') for line in merged)
+    return replay
+
+
+class StylesWriter:
+    """Writes newline-separated rules to `path`, buffering up to write_chunk_size characters.
+
+    Rules go to a temporary file next to `path` that only replaces it on close(), so a failed
+    build leaves the previous stylesheet in place.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.temp_path = f'{path}.tmp'
+        self.file = open(self.temp_path, 'w')
+        self.buffer = []
+        self.size = 0
+        self.count = 0
+
+    def write(self, rule):
+        if self.count:
+            self.buffer.append('\n')
+        self.buffer.append(rule)
+        self.size += len(rule) + 1
+        self.count += 1
+        if self.size >= write_chunk_size:
+            self.flush()
+
+    def flush(self):
+        self.file.write(''.join(self.buffer))
+        self.buffer.clear()
+        self.size = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+        print(f'generated {self.count} rules in {self.path}')
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
 
 variant_prefixes = {'hover','focus','dark','sm','md','lg','disabled','group-hover','group-open'}
 
 
 def add_rule(selector, declarations, media=None):
+    rules.append((selector, declarations, media))
+
+
+def render_rule(selector, declarations, media=None):
     rule = f"{selector}{{{';'.join(declarations)}}}"
     if media:
         rule = f"@media {media}{{{rule}}}"
-    rules.append(rule)
+    return rule
+
+
+def parse_rule(rule):
+    # only flat `selector{declarations}` rules; at-rules and nested blocks are left alone
+    selector, _, body = rule.partition('{')
+    if selector.startswith('@') or not body.endswith('}') or '{' in body:
+        return None
+    return (selector, [dec for dec in body[:-1].split(';') if dec], None)
+
+
+def split_declarations(declarations):
+    pairs = []
+    for dec in declarations:
+        # space-y rules pass several declarations in one string
+        for part in dec.split(';'):
+            prop, _, value = part.partition(':')
+            pairs.append((prop, value))
+    return pairs
+
+
+def collapse_transition(pairs):
+    found = {prop: value for prop, value in pairs if prop.startswith('transition-')}
+    if set(found) != {'transition-property', 'transition-duration', 'transition-timing-function'}:
+        return pairs
+    duration, timing = found['transition-duration'], found['transition-timing-function']
+    value = ','.join(f'{p.strip()} {duration} {timing}' for p in found['transition-property'].split(','))
+    longhand = sum(len(f'{prop}:{found[prop]};') for prop in found)
+    if len(f'transition:{value};') >= longhand:
+        return pairs
+    merged = []
+    for prop, val in pairs:
+        if prop == 'transition-property':
+            merged.append(('transition', value))
+        elif prop not in found:
+            merged.append((prop, val))
+    return merged
+
+
+def collapse_pairs(pairs, supported):
+    for shorthand, first, second in shorthand_pairs:
+        if shorthand not in supported:
+            continue
+        props = [prop for prop, _ in pairs]
+        if props.count(first) != 1 or props.count(second) != 1:
+            continue
+        values = dict(pairs)
+        if values[first] != values[second]:
+            continue
+        pairs = [(shorthand, val) if prop == first else (prop, val) for prop, val in pairs if prop != second]
+    return pairs
+
+
+def collect_custom_properties(entries, assigned):
+    for _, declarations, _ in entries:
+        for prop, value in split_declarations(declarations):
+            if prop.startswith('--'):
+                assigned.setdefault(prop, set()).add(value)
+
+
+def redundant_resets(assigned):
+    # A reset matching :root is only redundant when no rule ever assigns that property another value,
+    # otherwise an ancestor's value would be inherited instead of the reset
+    return {prop for prop, value in root_vars.items() if assigned.get(prop, {value}) == {value}}
+
+
+def optimize_rule(entry, supported, redundant):
+    selector, declarations, media = entry
+    pairs = [(prop, value) for prop, value in split_declarations(declarations) if prop not in redundant]
+    pairs = collapse_pairs(pairs, supported)
+    if 'transition' in supported:
+        pairs = collapse_transition(pairs)
+    if pairs:
+        return (selector, [f'{prop}:{value}' for prop, value in pairs], media)
 
 
 def handle_base(cls):
@@ -399,45 +890,20 @@ def handle_base(cls):
             dir_map = {'r':'right','l':'left','t':'top','b':'bottom','tr':'top right','tl':'top left','br':'bottom right','bl':'bottom left'}
             decs.append(f'background-image:linear-gradient(to {dir_map.get(direction, direction)}, var(--tw-gradient-stops))')
         else:
-            color_part = rest
-            alpha = None
-            if '/' in rest:
-                color_part, alpha = rest.split('/')
-                alpha = str(float(alpha)/100)
-            if '-' in color_part:
-                name, shade = color_part.split('-',1)
-            else:
-                name, shade = color_part, None
-            val = color_value(name, shade, alpha)
+            val = resolve_color(rest)
             if val:
                 decs.append(f'background-color:{val}')
     elif cls.startswith('from-'):
-        color_part = cls.replace('from-','')
-        alpha=None
-        if '/' in color_part:
-            color_part, alpha = color_part.split('/')
-            alpha = str(float(alpha)/100)
-        if '-' in color_part:
-            name, shade = color_part.split('-',1)
-        else:
-            name, shade = color_part, None
-        val = color_value(name, shade, alpha)
+        val = resolve_color(cls.replace('from-',''))
         if val:
             decs.append(f'--tw-gradient-from:{val}')
             decs.append('--tw-gradient-to:rgba(255,255,255,0)')
             decs.append('--tw-gradient-stops:var(--tw-gradient-from), var(--tw-gradient-to)')
     elif cls.startswith('to-'):
-        color_part = cls.replace('to-','')
-        alpha=None
-        if '/' in color_part:
-            color_part, alpha = color_part.split('/')
-            alpha = str(float(alpha)/100)
-        if '-' in color_part:
-            name, shade = color_part.split('-',1)
-            val = color_value(name, shade, alpha)
-            if val:
-                decs.append(f'--tw-gradient-to:{val}')
-                decs.append('--tw-gradient-stops:var(--tw-gradient-from), var(--tw-gradient-to)')
+        val = resolve_color(cls.replace('to-',''))
+        if val:
+            decs.append(f'--tw-gradient-to:{val}')
+            decs.append('--tw-gradient-stops:var(--tw-gradient-from), var(--tw-gradient-to)')
     elif cls.startswith('text-'):
         rest = cls.replace('text-','')
         if rest in font_sizes:
@@ -445,25 +911,11 @@ def handle_base(cls):
             decs.append(f'font-size:{size}')
             decs.append(f'line-height:{lh}')
         else:
-            alpha=None
-            if '/' in rest:
-                rest, alpha = rest.split('/')
-                alpha = str(float(alpha)/100)
-            if rest in ['white','black']:
-                val = color_value(rest, None, alpha)
-            elif '-' in rest:
-                name, shade = rest.split('-',1)
-                val = color_value(name, shade, alpha)
-            else:
-                val = None
+            val = resolve_color(rest)
             if val:
                 decs.append(f'color:{val}')
     elif cls.startswith('placeholder-'):
-        rest = cls.replace('placeholder-','')
-        val = None
-        if '-' in rest:
-            name, shade = rest.split('-',1)
-            val = color_value(name, shade)
+        val = resolve_color(cls.replace('placeholder-',''))
         if val:
             decs.append(f'color:{val}')
     elif cls.startswith('font-'):
@@ -500,21 +952,13 @@ def handle_base(cls):
         elif cls == 'border-none':
             decs.append('border-width:0')
         elif cls.startswith('border-'):
-            color_part = cls.replace('border-','')
-            if color_part == 'transparent':
-                decs.append('border-color:transparent')
-            elif '-' in color_part:
-                name, shade = color_part.split('-',1)
-                val = color_value(name, shade)
-                if val: decs.append(f'border-color:{val}')
+            val = resolve_color(cls.replace('border-',''))
+            if val: decs.append(f'border-color:{val}')
     elif cls.startswith('divide-'):
-        color_part = cls.replace('divide-','')
-        if '-' in color_part:
-            name, shade = color_part.split('-',1)
-            val = color_value(name, shade)
-            if val:
-                decs.append(f'--tw-divide-y-reverse:0')
-                decs.append(f'border-color:{val}')
+        val = resolve_color(cls.replace('divide-',''))
+        if val:
+            decs.append(f'--tw-divide-y-reverse:0')
+            decs.append(f'border-color:{val}')
     elif cls.startswith('rounded'):
         part = cls.replace('rounded','')
         if part.startswith('-'):
@@ -578,11 +1022,7 @@ def handle_base(cls):
             if opa:
                 decs.append(f'--tw-ring-opacity:{opa}')
         else:
-            if '-' in val:
-                name, shade = val.split('-',1)
-                col = color_value(name, shade)
-            else:
-                col = color_value(val)
+            col = resolve_color(val)
             if col:
                 decs.append(f'--tw-ring-color:{col}')
                 decs.append('box-shadow:var(--tw-ring-offset-shadow, 0 0 #0000), 0 0 0 3px var(--tw-ring-color), var(--tw-shadow, 0 0 #0000)')
@@ -729,7 +1169,7 @@ def process_class(full_cls):
             selector = '.group[open] ' + selector
     add_rule(selector, decs, media)
 
-for cls in sorted(classes):
+def generate_class(cls):
     if cls.startswith('space-y-'):
         val = spacing.get(cls.replace('space-y-',''))
         if val:
@@ -755,36 +1195,165 @@ for cls in sorted(classes):
     else:
         process_class(cls)
 
-# ensure gradient variables exist
-rules.insert(0, ':root{--tw-gradient-from:initial;--tw-gradient-to:initial;--tw-gradient-stops:initial;--tw-ring-color:rgba(59,130,246,0.5);}')
-rules.insert(0, 'body{font-family:"Inter", system-ui, -apple-system, sans-serif;}')
-rules.insert(0, '*{box-sizing:border-box;}')
-rules.insert(0, '.custom-scrollbar::-webkit-scrollbar{width:8px;height:8px;} .custom-scrollbar::-webkit-scrollbar-track{background:transparent;} .custom-scrollbar::-webkit-scrollbar-thumb{background-color:#cbd5e1;border-radius:4px;} .dark .custom-scrollbar::-webkit-scrollbar-thumb{background-color:#475569;}')
-rules.append('.list-none{list-style:none;}')
-rules.append('.outline-none{outline:none;}')
-rules.append('.transform{transform:translateZ(0);}')
-rules.append('.rotate-180{transform:rotate(180deg);}')
-rules.append('.animate-spin{animation:spin 1s linear infinite;}')
-rules.append('.animate-fadeIn{animation:fadeIn 0.3s ease-in-out;}')
-rules.append('@keyframes spin{to{transform:rotate(360deg);}}')
-rules.append('@keyframes fadeIn{from{opacity:0;}to{opacity:1;}}')
-rules.append('.line-clamp-1{-webkit-line-clamp:1;display:-webkit-box;-webkit-box-orient:vertical;overflow:hidden;}')
-rules.append('.line-clamp-2{-webkit-line-clamp:2;display:-webkit-box;-webkit-box-orient:vertical;overflow:hidden;}')
-rules.append('.line-clamp-3{-webkit-line-clamp:3;display:-webkit-box;-webkit-box-orient:vertical;overflow:hidden;}')
-rules.append('.placeholder-gray-500::placeholder{color:#6b7280;opacity:1;}')
-rules.append('.form-checkbox{appearance:none;border:1px solid #d1d5db;border-radius:0.25rem;width:1rem;height:1rem;display:inline-block;vertical-align:middle;}')
-rules.append('.border-dashed{border-style:dashed;}')
-rules.append('.divide-gray-200 > :not([hidden]) ~ :not([hidden]){border-color:#e5e7eb;}')
-rules.append('.divide-slate-700 > :not([hidden]) ~ :not([hidden]){border-color:#334155;}')
-rules.append('.mx-auto{margin-left:auto;margin-right:auto;}')
-rules.append('.ring-indigo-500{--tw-ring-color:#6366f1;}')
-rules.append('.text-\\[10px\\]{font-size:10px;}')
-rules.append('.border-dashed{border-style:dashed;}')
-rules.append('.divide-gray-200 > :not([hidden]) ~ :not([hidden]){border-color:#e5e7eb;}')
-rules.append('.divide-slate-700 > :not([hidden]) ~ :not([hidden]){border-color:#334155;}')
-rules.append('.mx-auto{margin-left:auto;margin-right:auto;}')
-rules.append('.ring-indigo-500{--tw-ring-color:#6366f1;}')
-rules.append('.text-\\[10px\\]{font-size:10px;}')
-
-open('styles.css','w').write('\n'.join(rules))
-print('generated', len(rules),'rules')
+
+def depends_on(deps, overlay):
+    # a lookup without a shade falls back to DEFAULT or the first shade, so any change to the palette counts
+    return any(name in overlay and (shade is None or shade in overlay[name]) for name, shade in deps)
+
+
+def resolve(cls):
+    color_deps.clear()
+    generate_class(cls)
+    entries = rules[:]
+    rules.clear()
+    return entries
+
+
+def resolve_classes(classes, themes):
+    # Yields each class's base rules together with its rules per theme. Classes that read no
+    # overridden color token are resolved once and share the base rules with every theme.
+    for cls in classes:
+        entries = resolve(cls)
+        deps = set(color_deps)
+        themed_entries = {}
+        for theme, overlay in themes.items():
+            # also when the base palette produced nothing: the overlay may add the shade or palette
+            if depends_on(deps, overlay):
+                with themed(overlay):
+                    themed_entries[theme] = resolve(cls)
+        yield entries, themed_entries
+
+
+def scope_selector(selector, theme):
+    # the theme attribute lives on <html> next to the dark class; :where keeps the specificity of
+    # the base rule so hover, dark and responsive variants still win over a themed base color
+    scope = f':where([data-theme="{theme}"])'
+    if selector.startswith('.dark '):
+        return scope + selector
+    return f'{scope} {selector}'
+
+prelude = [
+    '.custom-scrollbar::-webkit-scrollbar{width:8px;height:8px;} .custom-scrollbar::-webkit-scrollbar-track{background:transparent;} .custom-scrollbar::-webkit-scrollbar-thumb{background-color:#cbd5e1;border-radius:4px;} .dark .custom-scrollbar::-webkit-scrollbar-thumb{background-color:#475569;}',
+    '*{box-sizing:border-box;}',
+    'body{font-family:"Inter", system-ui, -apple-system, sans-serif;}',
+    # ensure gradient variables exist
+    ':root{' + ''.join(f'{prop}:{value};' for prop, value in root_vars.items()) + '}',
+]
+extras = [
+    '.list-none{list-style:none;}',
+    '.outline-none{outline:none;}',
+    '.transform{transform:translateZ(0);}',
+    '.rotate-180{transform:rotate(180deg);}',
+    '.animate-spin{animation:spin 1s linear infinite;}',
+    '.animate-fadeIn{animation:fadeIn 0.3s ease-in-out;}',
+    '@keyframes spin{to{transform:rotate(360deg);}}',
+    '@keyframes fadeIn{from{opacity:0;}to{opacity:1;}}',
+    '.line-clamp-1{-webkit-line-clamp:1;display:-webkit-box;-webkit-box-orient:vertical;overflow:hidden;}',
+    '.line-clamp-2{-webkit-line-clamp:2;display:-webkit-box;-webkit-box-orient:vertical;overflow:hidden;}',
+    '.line-clamp-3{-webkit-line-clamp:3;display:-webkit-box;-webkit-box-orient:vertical;overflow:hidden;}',
+    '.placeholder-gray-500::placeholder{color:#6b7280;opacity:1;}',
+    '.form-checkbox{appearance:none;border:1px solid #d1d5db;border-radius:0.25rem;width:1rem;height:1rem;display:inline-block;vertical-align:middle;}',
+    '.border-dashed{border-style:dashed;}',
+    '.divide-gray-200 > :not([hidden]) ~ :not([hidden]){border-color:#e5e7eb;}',
+    '.divide-slate-700 > :not([hidden]) ~ :not([hidden]){border-color:#334155;}',
+    '.mx-auto{margin-left:auto;margin-right:auto;}',
+    '.ring-indigo-500{--tw-ring-color:#6366f1;}',
+    '.text-\\[10px\\]{font-size:10px;}',
+    '.border-dashed{border-style:dashed;}',
+    '.divide-gray-200 > :not([hidden]) ~ :not([hidden]){border-color:#e5e7eb;}',
+    '.divide-slate-700 > :not([hidden]) ~ :not([hidden]){border-color:#334155;}',
+    '.mx-auto{margin-left:auto;margin-right:auto;}',
+    '.ring-indigo-500{--tw-ring-color:#6366f1;}',
+    '.text-\\[10px\\]{font-size:10px;}',
+]
+
+def build(classes, themes):
+    outputs = {}
+    try:
+        outputs[None] = StylesWriter('styles.css')
+        if not args.theme_scope:
+            for theme in themes:
+                outputs[theme] = StylesWriter(f'styles.{theme}.css')
+        if args.target:
+            supported = browser_targets[args.target]
+            assigned = {}
+            for entries, themed_entries in resolve_classes(classes(), themes):
+                collect_custom_properties(entries, assigned)
+                for theme, theme_entries in themed_entries.items():
+                    collect_custom_properties(theme_entries, assigned)
+            collect_custom_properties(filter(None, map(parse_rule, extras)), assigned)
+            redundant = redundant_resets(assigned)
+        saved = 0
+
+        def emit(output, entry, rule=None):
+            nonlocal saved
+            rule = rule or render_rule(*entry)
+            if args.target:
+                entry = optimize_rule(entry, supported, redundant)
+                optimized = render_rule(*entry) if entry else ''
+                saved += len(rule.encode()) - len(optimized.encode()) + (0 if entry else 1)
+                if not entry:
+                    return
+                rule = optimized
+            output.write(rule)
+
+        for output in outputs.values():
+            for rule in prelude:
+                output.write(rule)
+        re_resolved = dict.fromkeys(themes, 0)
+        for entries, themed_entries in resolve_classes(classes(), themes):
+            for theme, output in outputs.items():
+                for entry in themed_entries.get(theme, entries):
+                    emit(output, entry)
+            for theme, theme_entries in themed_entries.items():
+                re_resolved[theme] += len(theme_entries)
+                if args.theme_scope:
+                    # right after the base rule, so source order settles ties exactly as it does for the base rule
+                    for selector, decs, media in theme_entries:
+                        emit(outputs[None], (scope_selector(selector, theme), decs, media))
+        for theme, count in re_resolved.items():
+            print(f'theme {theme}: re-resolved {count} rules')
+        # a repeated rule keeps its last position, which is the one the cascade honours
+        last_copy = {rule: index for index, rule in enumerate(extras)}
+        for output in outputs.values():
+            for index, rule in enumerate(extras):
+                if args.target:
+                    if last_copy[rule] != index:
+                        saved += len(rule.encode()) + 1
+                        continue
+                    entry = parse_rule(rule)
+                    if entry:
+                        emit(output, entry, rule)
+                        continue
+                output.write(rule)
+        if args.target:
+            print(f'optimized for {args.target} browsers: saved {saved} bytes')
+        for output in outputs.values():
+            output.close()
+    except BaseException:
+        for output in outputs.values():
+            output.discard()
+        raise
+
+
+themes = json.load(open(args.themes)) if args.themes else {}
+if not isinstance(themes, dict):
+    parser.error('--themes: expected an object mapping theme names to palette overlays')
+for theme, overlay in themes.items():
+    # theme names end up in styles.<theme>.css and in [data-theme="<theme>"]
+    if not theme_name.fullmatch(theme):
+        parser.error(f'--themes: theme name {theme!r} may only contain letters, digits, "-" and "_"')
+    if not isinstance(overlay, dict) or not all(isinstance(palette, dict) for palette in overlay.values()):
+        parser.error(f'--themes: theme {theme!r} must map palette names to objects of shades')
+    try:
+        theme_table(overlay)
+    except ValueError as error:
+        parser.error(f'--themes: theme {theme!r}: {error}')
+if args.since_git:
+    signature = build_signature(themes)
+    snapshot, stale = git_changed_classes(signature, themes)
+    if stale:
+        build(sort_classes(set().union(*snapshot.values()), args.max_classes_in_memory), themes)
+        record_build(signature, snapshot)
+else:
+    build(sort_classes(scan_classes(discover_sources('.')), args.max_classes_in_memory), themes)